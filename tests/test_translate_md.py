@@ -0,0 +1,215 @@
+import contextlib
+import functools
+import glob
+import os
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+from click.testing import CliRunner
+
+import translate_md
+
+
+class EchoTranslator:
+    """Stand-in for `deepl.Translator` that returns the texts it is given."""
+
+    def __init__(self, limit=10**6):
+        self.requests = []
+        self.count = 0
+        self.limit = limit
+
+    def translate_text(self, texts, **kwargs):
+        self.requests.append(texts)
+        self.count += sum(map(len, texts))
+        return [types.SimpleNamespace(text=text) for text in texts]
+
+    def create_glossary(self, name, **kwargs):
+        return types.SimpleNamespace(name=name)
+
+    def delete_glossary(self, glossary):
+        pass
+
+    def get_usage(self):
+        return types.SimpleNamespace(
+            any_limit_reached=self.count >= self.limit,
+            character=types.SimpleNamespace(
+                valid=True, count=self.count, limit=self.limit
+            ),
+        )
+
+
+def translate_markdown(markdown_content):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        markdown_file = os.path.join(tmp_dir, "index.md")
+        with open(markdown_file, "w") as fout:
+            fout.write(markdown_content)
+        output_file = os.path.join(tmp_dir, "es", "index.md")
+        with mock.patch.object(
+            translate_md, "_get_translator", return_value=EchoTranslator()
+        ), mock.patch.object(
+            translate_md,
+            "TRANSLATION_CACHE_FILE",
+            os.path.join(tmp_dir, ".translate_md_cache"),
+        ):
+            translate_md.translate_markdown_file(
+                markdown_file,
+                output_file=output_file,
+                target_lang="ES",
+                auth_key="not-a-real-key",
+                char_count_only=False,
+                use_cache=False,
+            )
+        with open(output_file, "r") as fin:
+            return fin.read()
+
+
+class PrivateUseCharacterTest(unittest.TestCase):
+    def test_glyph_next_to_inline_code(self):
+        markdown = "Click the \uf09b icon to open `git` here.\n"
+        self.assertEqual(translate_markdown(markdown).strip(), markdown.strip())
+
+    def test_glyph_without_inline_code(self):
+        markdown = "Plain \uf09b icon.\n"
+        self.assertEqual(translate_markdown(markdown).strip(), markdown.strip())
+
+    def test_first_placeholder_in_text(self):
+        markdown = "The \ue000 glyph and `code` stay apart.\n"
+        self.assertEqual(translate_markdown(markdown).strip(), markdown.strip())
+
+
+class SkipWordsTest(unittest.TestCase):
+    def test_headings_and_paragraphs_are_skipped(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            markdown_file = os.path.join(tmp_dir, "index.md")
+            with open(markdown_file, "w") as fout:
+                fout.write("# TODO\n\nTODO\n")
+            count = functools.partial(
+                translate_md.translate_markdown_file_list,
+                [markdown_file],
+                target_lang="ES",
+                no_cache=True,
+            )
+            self.assertGreater(count()[0], 0)
+            self.assertEqual(count(skip_words=["TODO"])[0], 0)
+
+
+@contextlib.contextmanager
+def lesson_directory(**files):
+    """Work in a temporary directory holding the given markdown files (the cache and
+    state files are written to the working directory)."""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        try:
+            for name, text in files.items():
+                with open(name + ".md", "w") as fout:
+                    fout.write(text)
+            yield tmp_dir
+        finally:
+            os.chdir(cwd)
+
+
+def translate_lesson(translator, markdown_files, target_lang="ES", **kwargs):
+    with mock.patch.object(translate_md, "_get_translator", return_value=translator):
+        return translate_md.translate_markdown_file_list(
+            markdown_files,
+            target_lang=target_lang,
+            output_subdir=True,
+            char_count_only=False,
+            auth_key="not-a-real-key",
+            **kwargs,
+        )
+
+
+class CreditCheckTest(unittest.TestCase):
+    def test_every_run_checks_credits(self):
+        translator = EchoTranslator()
+        with lesson_directory(a="Hello world.\n", b="Goodbye.\n"):
+            translate_lesson(translator, ["a.md"])
+            # Leave too little quota for the second file
+            translator.limit = translator.count + 5
+            with self.assertRaises(RuntimeError):
+                translate_lesson(translator, ["b.md"])
+        self.assertEqual(len(translator.requests), 1)
+
+
+class TranslationStateTest(unittest.TestCase):
+    def test_no_cache_keeps_other_files(self):
+        translator = EchoTranslator()
+        with lesson_directory(a="Hello world.\n", b="Goodbye.\n"):
+            translate_lesson(translator, ["a.md", "b.md"])
+            translate_lesson(translator, ["a.md"], no_cache=True)
+            self.assertEqual(
+                sorted(translate_md.load_translation_state()),
+                [os.path.join("ES", "a.md"), os.path.join("ES", "b.md")],
+            )
+        # One request for each file, and then only the file we forced again
+        self.assertEqual(len(translator.requests), 3)
+
+    def test_languages_keep_their_own_state(self):
+        translator = EchoTranslator()
+        with lesson_directory(a="Hello world.\n"):
+            translate_lesson(translator, ["a.md"], target_lang="ES")
+            translate_lesson(translator, ["a.md"], target_lang="FR")
+            with mock.patch.object(
+                translate_md,
+                "translate_markdown_file",
+                wraps=translate_md.translate_markdown_file,
+            ) as translate_markdown_file:
+                translate_lesson(translator, ["a.md"], target_lang="ES")
+            translate_markdown_file.assert_not_called()
+        self.assertEqual(len(translator.requests), 2)
+
+
+class OutputFilesTest(unittest.TestCase):
+    def translate_in_turn(self, *args):
+        with mock.patch.object(
+            translate_md, "_get_translator", return_value=EchoTranslator()
+        ):
+            for target_lang in ("es", "fr", "de", "es"):
+                result = CliRunner().invoke(
+                    translate_md.translate_markdown_files,
+                    [
+                        "--input-markdown-filestring",
+                        "**/*.md",
+                        "--target-lang",
+                        target_lang,
+                        "--authentication-key",
+                        "not-a-real-key",
+                    ]
+                    + list(args),
+                )
+                self.assertIsNone(result.exception)
+        return sorted(glob.glob("**/*.md", recursive=True))
+
+    def test_subdir_outputs_are_not_translated(self):
+        with lesson_directory(a="Hello world.\n"):
+            self.assertEqual(
+                self.translate_in_turn("--output-subdir"),
+                ["a.md"]
+                + [os.path.join(language, "a.md") for language in ("de", "es", "fr")],
+            )
+
+    def test_suffix_outputs_are_not_translated(self):
+        with lesson_directory(a="Hello world.\n"):
+            self.assertEqual(
+                self.translate_in_turn("--output-suffix"),
+                ["a.md", "a_de.md", "a_es.md", "a_fr.md"],
+            )
+
+    def test_output_file_names_for_any_language(self):
+        is_output = translate_md.is_output_file_name
+        for language in ("es", "fr", "DE"):
+            self.assertTrue(
+                is_output(os.path.join(language, "a.md"), output_subdir=True)
+            )
+            self.assertTrue(is_output("a_%s.md" % language, output_suffix=True))
+        self.assertFalse(is_output(os.path.join("docs", "a.md"), output_subdir=True))
+        self.assertFalse(is_output("read_me.md", output_suffix=True))
+        self.assertFalse(is_output("a_es.md"))
+
+
+if __name__ == "__main__":
+    unittest.main()
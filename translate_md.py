@@ -4,21 +4,29 @@ import sys
 import yaml
 import glob
 import csv
+import json
 import deepl
 import mistletoe
-import pathlib
+import mistletoe.token
 import frontmatter
 import click
-import tempfile
+import xml.sax.saxutils
+import functools
+import atexit
+import hashlib
+import shelve
+import dbm
+import threading
+import concurrent.futures
+import contextlib
+from mistletoe.block_tokenizer import tokenize as tokenize_blocks
 from mistletoe.block_token import (
     BlockToken,
     Heading,
     Paragraph,
-    SetextHeading,
-    ThematicBreak,
 )
-from mistletoe.markdown_renderer import MarkdownRenderer, BlankLine
-from mistletoe.span_token import InlineCode, RawText, SpanToken, Image
+from mistletoe.markdown_renderer import MarkdownRenderer
+from mistletoe.span_token import RawText, Image, InlineCode
 
 # Define the max line length for our MarkdownRenderer to ensure paragraphs are single lines
 MAX_LINE_LENGTH = 10000
@@ -70,9 +78,23 @@ DEEPL_GLOSSARY_LANGUAGES = [
     "RU",
     "ZH",
 ]
+# Sets of the language codes, for quick lookups when checking arguments
+ACCEPTED_SOURCE_LANGUAGES = frozenset(lang[0] for lang in DEEPL_SOURCE_LANGUAGES)
+ACCEPTED_TARGET_LANGUAGES = frozenset(lang[0] for lang in DEEPL_TARGET_LANGUAGES)
+ACCEPTED_GLOSSARY_LANGUAGES = frozenset(DEEPL_GLOSSARY_LANGUAGES)
 # Request body size limit of 128 KiB, which is 16K characters
 # (but we also need to leave room for any other arguments)
 DEEPL_MAX_REQUEST_CHARACTERS = 12000
+# DeepL accepts at most 50 texts in a single request
+DEEPL_MAX_REQUEST_TEXTS = 50
+# DeepL requests are network bound, so we can have several in flight at once
+# (DeepL copes fine with around 10 concurrent requests)
+MAX_PARALLEL_REQUESTS = 10
+# ...in total, across all the files we are working on (this is also the size of the
+# connection pool of the DeepL translator, so every request can reuse a connection)
+_DEEPL_REQUEST_SLOTS = threading.BoundedSemaphore(MAX_PARALLEL_REQUESTS)
+# ...and we can work on several files at once (by default)
+MAX_PARALLEL_FILES = 8
 MAX_TRANSLATION_CONTEXT = DEEPL_MAX_REQUEST_CHARACTERS
 # Define accepted markdown formats
 ACCEPTED_MARKDOWN_FILE_EXTENSIONS = [
@@ -86,9 +108,65 @@ ACCEPTED_MARKDOWN_FILE_EXTENSIONS = [
     ".markdown",
     ".text",
 ]
-# Define our markers for the beginning and end of the translation
-START_MARKER = "XYZ.1"
-END_MARKER = "".join(reversed(START_MARKER))
+# Translations are cached on disk so re-running on (partially) edited files only
+# requires translating what has changed
+TRANSLATION_CACHE_FILE = ".translate_md_cache"
+# shelve does not support concurrent access, so we serialise it ourselves
+_TRANSLATION_CACHE_LOCK = threading.Lock()
+# mistletoe keeps some state at module level (the registered token types and the
+# root node used for link references), so we serialise parsing and rendering
+_MISTLETOE_LOCK = threading.RLock()
+# We also keep track of which files we have translated (and from what), so that
+# unchanged files can be skipped entirely
+TRANSLATION_STATE_FILE = ".translate_md_state.json"
+# We are only translating selected elements of the markdown (the exact types are
+# checked, which is cheaper than isinstance() for every token we visit)
+TRANSLATABLE_BLOCK_TYPES = frozenset((Paragraph, Heading))
+# ...and a translated block can only be one of those again, so those are the only
+# block tokenizers mistletoe needs to try when parsing a translation
+TRANSLATED_BLOCK_TOKENIZERS = [Heading, Paragraph]
+# Blocks are sent for translation as XML (so the translator keeps our markup intact),
+# wrapped in a block tag, with inline code inside a tag that the translator ignores
+BLOCK_TAG = "b"
+BLOCK_START_TAG = "<%s>" % BLOCK_TAG
+BLOCK_END_TAG = "</%s>" % BLOCK_TAG
+IGNORE_TAG = "c"
+IGNORE_START_TAG = "<%s>" % IGNORE_TAG
+IGNORE_END_TAG = "</%s>" % IGNORE_TAG
+# The translator may return quotes as XML entities too
+XML_UNESCAPE_ENTITIES = {"&quot;": '"', "&apos;": "'"}
+INLINE_CODE_PATTERN = re.compile(r"(`+)( ?)[\ue000-\uf8ff]\2\1")
+
+# Inline code is replaced by placeholders while translating, we use characters from
+# the Unicode private use area (U+E000 to U+F8FF) which are passed through untouched
+CODE_SPAN_PATTERN = re.compile(r"(?<!`)(`+)(?!`)(.+?)(?<!`)\1(?!`)", re.DOTALL)
+PLACEHOLDER_START = 0xE000
+PLACEHOLDER_END = 0xF8FF
+PLACEHOLDER_PATTERN = re.compile("[\ue000-\uf8ff]")
+UNQUOTED_PLACEHOLDER_PATTERN = re.compile("(?<!`)([\ue000-\uf8ff])(?!`)")
+# Characters that can start any markdown syntax within a paragraph, or placeholders
+# (if a translation has none of these then it is plain text and needs no parsing)
+MARKDOWN_SYNTAX_PATTERN = re.compile(r"[\\`*_\[\]<>!&~#\n\ue000-\uf8ff]")
+
+# Special syntax (Carpentries Workbench ':::' and Galaxy '{: ' markers, which may be
+# quoted) that needs to be surrounded by the correct separation
+SPECIAL_SYNTAX_FIRST_CHARACTERS = frozenset(":{>")
+QUOTED_GALAXY_MARKER_PATTERN = re.compile(r"^>\s+\{: ")
+DOUBLE_QUOTED_GALAXY_MARKER_PATTERN = re.compile(r"^>\s+>\s+\{: ")
+DOUBLE_QUOTE_PATTERN = re.compile(r"^>\s+>")
+TRIPLE_QUOTE_PATTERN = re.compile(r"^>\s+>\s+>")
+
+# Markdown characters we remove from lines used for the translation context
+EMPHASIS_PATTERN = re.compile(r"\*\*|__")
+TEXT_LINE_LSTRIP_CHARS = "#:-*`{}"
+
+# Use the (safe) C implementations of the YAML loader/dumper if we have them
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+YAML_DUMPER = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+# URLs are never translated
+URL_PATTERN = re.compile(r"(?:https?|ftp)://\S+")
+# Regular expression to match front matter delimited by "---" or "+++"
+FRONT_MATTER_PATTERN = re.compile(r"^(---|[+]{3})([\s\S]*?)\1\n")
 
 # Some special syntax string used by Galaxy
 GALAXY_SYNTAX_STRINGS = [
@@ -100,16 +178,17 @@ GALAXY_SYNTAX_STRINGS = [
     "hands-on-title",
     "comment-title",
 ]
+# (which map to themselves in our glossaries, so they are never translated)
+GALAXY_SYNTAX_GLOSSARY = {item: item for item in GALAXY_SYNTAX_STRINGS}
 
 
-def surround_special_syntax_with_correct_separation(input_file):
-    # Read the contents of the input file
-    with open(input_file, "r") as file:
-        lines = file.readlines()
-
+def surround_special_syntax_with_correct_separation(lines):
     modified_lines = []
     for i, line in enumerate(lines):
-        if line.startswith(":::"):
+        # Most lines can't be special syntax, so don't bother checking them
+        if line[:1] not in SPECIAL_SYNTAX_FIRST_CHARACTERS:
+            modified_lines.append(line)
+        elif line[:3] == ":::":
             # Check if there is already a blank line before
             if i == 0 or lines[i - 1].strip() != "":
                 modified_lines.append("\n")
@@ -120,7 +199,7 @@ def surround_special_syntax_with_correct_separation(input_file):
             if i == len(lines) - 1 or lines[i + 1].strip() != "":
                 modified_lines.append("\n")
         # Below we handle Galaxy format which may include nesting
-        elif line.startswith("{: "):
+        elif line[:3] == "{: ":
             # Check if there is already > and nothing else before
             if i == 0 or modified_lines[-1].strip() != ">":
                 modified_lines.append(">\n")
@@ -130,9 +209,9 @@ def surround_special_syntax_with_correct_separation(input_file):
             # Check if there is already a blank line after
             if i == len(lines) - 1 or lines[i + 1].strip() != "":
                 modified_lines.append("\n")
-        elif re.match(r"^>\s+\{: ", line):
+        elif QUOTED_GALAXY_MARKER_PATTERN.match(line):
             # Check if there is already > and nothing else before
-            if i == 0 or re.match(r"^>\s+>", modified_lines[-1].strip()):
+            if i == 0 or DOUBLE_QUOTE_PATTERN.match(modified_lines[-1].strip()):
                 modified_lines.append("> >\n")
 
             modified_lines.append(line)
@@ -140,96 +219,290 @@ def surround_special_syntax_with_correct_separation(input_file):
             # Check if there is already a blank line after
             if i == len(lines) - 1 or lines[i + 1].strip() != ">":
                 modified_lines.append(">\n")
-        elif re.match(r"^>\s+>\s+\{: ", line):
+        elif DOUBLE_QUOTED_GALAXY_MARKER_PATTERN.match(line):
             # Check if there is already > and nothing else before
-            if i == 0 or re.match(r"^>\s+>\s+>", modified_lines[-1].strip()):
+            if i == 0 or TRIPLE_QUOTE_PATTERN.match(modified_lines[-1].strip()):
                 modified_lines.append("> > >\n")
 
             modified_lines.append(line)
 
             # Check if there is already a blank line after
-            if i == len(lines) - 1 or re.match(r"^>\s+>", lines[i + 1].strip()):
+            if i == len(lines) - 1 or DOUBLE_QUOTE_PATTERN.match(lines[i + 1].strip()):
                 modified_lines.append("> >\n")
         else:
             modified_lines.append(line)
 
-    # Create a temporary file and write the modified lines into it
-    temp_file = tempfile.NamedTemporaryFile(delete=False, mode="w+", suffix=".md")
-    temp_file.writelines(modified_lines)
-    temp_file.seek(0)  # Go back to the start of the file for reading if needed
-
-    # Print the path of the temporary file
-    print("Temporary file created:", temp_file.name)
+    return modified_lines
 
-    # Close the file (will remain in filesystem due to delete=False)
-    temp_file.close()
 
-    return temp_file.name
-
-
-def remove_front_matter_from_file(filepath):
+def remove_front_matter(content):
     """
-    Removes front matter from a Markdown file in place.
+    Removes front matter from the contents of a Markdown file.
 
     Args:
-        filepath (str): Path to the Markdown file.
+        content (str): Contents of the Markdown file.
 
     Returns:
-        bool: True if front matter was removed, False if no front matter was found.
+        str: The contents without the front matter (unchanged if there was none).
     """
-    with open(filepath, "r") as file:
-        content = file.read()
-
-    # Regular expression to match front matter delimited by "---" or "+++"
-    cleaned_content = re.sub(r"^(---|[+]{3})[\s\S]*?\1\n", "", content, count=1)
+    return FRONT_MATTER_PATTERN.sub("", content, count=1)
 
-    # Check if any changes were made
-    if content != cleaned_content:
-        with open(filepath, "w") as file:
-            file.write(cleaned_content)
-        return True  # Front matter was found and removed
 
-    return False  # No front matter was found
+def replace_inline_code(markdown_text: str, inline_code_dict: dict) -> str:
+    """Replace the contents of the inline code in a rendered markdown block with
+    placeholders (keeping the backticks), the original contents are stored in
+    `inline_code_dict`. Working on the text is a single regex pass rather than a
+    walk over the token tree."""
 
-
-def replace_inline_code(token: SpanToken, inline_code_dict: dict):
-    """Update the text contents of a span token and its children.
-    `InlineCode` tokens are left unchanged."""
-    if isinstance(token, InlineCode):
+    def stash(match):
         # Generate a  placeholder
-        placeholder = "x%03dy" % len(inline_code_dict)
+        placeholder = next(free_placeholders)
         # Add the placeholder to the dict
-        inline_code_dict[placeholder] = token.children[0].content
-        token.children[0].content = placeholder
+        inline_code_dict[placeholder] = match.group(2)
+        return match.group(1) + placeholder + match.group(1)
 
-    if (
-        hasattr(token, "children")
-        and not isinstance(token, InlineCode)
-        and token.children is not None
-    ):
-        for child in token.children:
-            replace_inline_code(child, inline_code_dict)
+    # Most blocks have no inline code at all, so don't even start the regex engine
+    if "`" not in markdown_text:
+        return markdown_text
+
+    # The text itself may use private use characters (e.g. icon font glyphs), so our
+    # placeholders need to be ones that don't already appear in it
+    used_characters = set(PLACEHOLDER_PATTERN.findall(markdown_text))
+    free_placeholders = (
+        chr(code_point)
+        for code_point in range(PLACEHOLDER_START, PLACEHOLDER_END + 1)
+        if chr(code_point) not in used_characters
+    )
+    return CODE_SPAN_PATTERN.sub(stash, markdown_text)
 
 
-def restore_inline_code(token: SpanToken, inline_code_dict: dict):
-    """Update the text contents of a span token and its children.
-    `InlineCode` tokens are left unchanged."""
-    if isinstance(token, InlineCode):
-        if token.children[0].content in inline_code_dict.keys():
-            token.children[0].content = inline_code_dict.pop(token.children[0].content)
+def restore_inline_code(markdown_text: str, inline_code_dict: dict) -> str:
+    """Put the contents of the inline code back in place of the placeholders in a
+    markdown block, restored placeholders are removed from `inline_code_dict`."""
+    if not inline_code_dict:
+        return markdown_text
+    return PLACEHOLDER_PATTERN.sub(
+        lambda match: inline_code_dict.pop(match.group(0), match.group(0)),
+        markdown_text,
+    )
+
+
+def _collect_blocks(
+    token: BlockToken,
+    acc: list,
+    renderer,
+    ignore_triple_colon=True,
+    ignore_galaxy_marker=True,
+    skip_words=frozenset(),
+):
+    """Walk a block and its children, preparing every paragraph and heading for
+    translation. Nothing is translated here, each prepared block is added to `acc`
+    so that all of them can be sent to the translator in one go.
+
+    `acc` holds parallel lists (one entry per block) for the keys "tokens",
+    "markdown_texts", "inline_code_dicts" and "add_alts"."""
+
+    # Walk the tree with an explicit stack
+    stack = [token]
+    while stack:
+        token = stack.pop()
+
+        # We are only translating selected elements of the markdown
+        token_type = type(token)
+        if token_type in TRANSLATABLE_BLOCK_TYPES:
+            children = token.children
+            # Paragraphs can start with some special syntax that we leave alone
+            if token_type is Paragraph and type(children[0]) is RawText:
+                first_text = children[0].content
+            else:
+                first_text = ""
+            # Ignore any paragraph that starts with ':::' (this is Carpentries Workbench specific)
+            if ignore_triple_colon and first_text[:3] == ":::":
+                pass
+            # Ignore any paragraph that starts with '{: ' (this is Galaxy specific)
+            elif ignore_galaxy_marker and first_text[:3] == "{: ":
+                pass
+            # Ignore any block that is only inline code or images without any alt text
+            # or title (no need to even render it)
+            elif all(
+                type(child) is InlineCode
+                or (type(child) is RawText and not child.content.strip())
+                or (type(child) is Image and not child.children and not child.title)
+                for child in children
+            ):
+                pass
+            else:
+                # If we have the alt text that is plain html and sits beside an image
+                # then let's chop the tags off and reinsert them later
+                add_alt = (
+                    token_type is Paragraph
+                    and len(children) > 1
+                    and type(children[0]) is Image
+                    and type(children[1]) is RawText
+                    and children[1].content.startswith("{alt='")
+                    and type(children[-1]) is RawText
+                    and children[-1].content.endswith("'}")
+                )
+                # Reconstruct the resulting markdown block to give a full context to
+                # translate and replace all the inline code blocks with placeholders
+                # (a plain text paragraph renders to just its text)
+                inline_code_dict = {}
+                if _is_plain_paragraph(token):
+                    markdown_text = token.children[0].content + "\n"
+                else:
+                    markdown_text = renderer.render(token)
+                if add_alt:
+                    # The tags are chopped off the text (the token itself is left
+                    # alone, so nothing needs undoing if we never translate it)
+                    markdown_text = markdown_text.replace("{alt='", "", 1).rstrip()
+                    markdown_text = markdown_text[: -len("'}")] + "\n"
+                markdown_text = replace_inline_code(markdown_text, inline_code_dict)
+                # Don't send anything that would come back unchanged
+                # (alt text always needs to be translated, and the text of a heading
+                # is what we compare with the words to skip)
+                if not add_alt and not has_translatable_text(
+                    (
+                        markdown_text[token.level + 1 :]
+                        if token_type is Heading
+                        else markdown_text
+                    ),
+                    skip_words=skip_words,
+                ):
+                    continue
+                acc["tokens"].append(token)
+                acc["markdown_texts"].append(markdown_text)
+                acc["inline_code_dicts"].append(inline_code_dict)
+                acc["add_alts"].append(add_alt)
+
+        # Paragraphs and headings only contain span tokens, so we only need to look
+        # inside the other (container) blocks
+        elif hasattr(token, "children") and token.children is not None:
+            # Push in reverse so that blocks are collected in document order
+            for child in reversed(token.children):
+                if isinstance(child, BlockToken):
+                    stack.append(child)
+
+
+def _is_plain_paragraph(token):
+    # A single line paragraph with no markdown syntax at all
+    return (
+        type(token) is Paragraph
+        and len(token.children) == 1
+        and type(token.children[0]) is RawText
+    )
+
 
-    if (
-        hasattr(token, "children")
-        and not isinstance(token, InlineCode)
-        and token.children is not None
+def _plain_translation(token, translated_markdown):
+    """If `token` is plain text (a paragraph or heading with a single RawText) and so
+    is its translation, return the translated text, otherwise return None."""
+    if len(token.children) != 1 or type(token.children[0]) is not RawText:
+        return None
+    if type(token) is Heading:
+        # The translation should still be a heading of the same level
+        prefix = "#" * token.level + " "
+        if not translated_markdown.startswith(prefix):
+            return None
+        translated_markdown = translated_markdown[len(prefix) :]
+    if MARKDOWN_SYNTAX_PATTERN.search(translated_markdown):
+        return None
+    return translated_markdown
+
+
+def has_translatable_text(markdown_text, skip_words=frozenset()):
+    """Check if a markdown block (with its inline code replaced by placeholders) has
+    anything to translate, i.e., some actual words which are not in `skip_words`
+    (and not just part of a URL)."""
+    text = URL_PATTERN.sub("", PLACEHOLDER_PATTERN.sub("", markdown_text)).strip()
+    if text in skip_words:
+        return False
+    return any(character.isalpha() for character in text)
+
+
+def _parse_translated_block(translated_markdown):
+    """Parse a translated paragraph/heading back into block tokens. We know what kind
+    of block we are expecting so we only need the relevant tokenizers, and we avoid
+    setting up a full `mistletoe.Document` for each block."""
+    lines = [line + "\n" for line in translated_markdown.split("\n")]
+    return tokenize_blocks(lines, TRANSLATED_BLOCK_TOKENIZERS)
+
+
+def _apply_translations(acc, translations, root=None):
+    """Put the translated markdown back into the blocks in `acc`. The blocks are
+    updated in place (only their children are replaced) so the type of each block,
+    and the structure of the tree it belongs to, never change."""
+
+    # Span tokens look up link reference definitions on the root node, so use the
+    # document we are translating for that (if we have it)
+    with _MISTLETOE_LOCK:
+        if not hasattr(root, "footnotes"):
+            root = mistletoe.Document("")
+        mistletoe.token._root_node = root
+        try:
+            _apply_translations_to_blocks(acc, translations)
+        finally:
+            mistletoe.token._root_node = None
+
+
+def _apply_translations_to_blocks(acc, translations):
+    for token, markdown_text, inline_code_dict, add_alt, translated_markdown in zip(
+        acc["tokens"],
+        acc["markdown_texts"],
+        acc["inline_code_dicts"],
+        acc["add_alts"],
+        translations,
     ):
-        for child in token.children:
-            restore_inline_code(child, inline_code_dict)
+        # A plain text block that was translated to plain text doesn't need the
+        # placeholder checks or parsing, we can just swap the text
+        if not inline_code_dict:
+            plain_text = _plain_translation(token, translated_markdown)
+            if plain_text is not None:
+                token.children[0].content = plain_text
+                continue
+
+        # Ensure inline code syntax is preserved
+        # (some failures are allowed, so we also may be updating the dictionary)
+        translated_markdown, inline_code_dict = ensure_inline_code_syntax(
+            translated_markdown, inline_code_dict=inline_code_dict
+        )
+
+        # Replace all the placeholders with their inline codeblocks
+        translated_markdown = restore_inline_code(translated_markdown, inline_code_dict)
+        if len(inline_code_dict):
+            raise RuntimeError(
+                "Something went wrong, you should have an empty dict after translation "
+                "but you have: %s\nOriginal:\n%s\nTranslation:\n%s"
+                % (inline_code_dict, markdown_text, translated_markdown)
+            )
+
+        # Deconstruct the resulting markdown again and identify the token we need
+        translated_tokens = _parse_translated_block(translated_markdown)
+
+        translated_token = None
+        for child in translated_tokens:
+            # Assuming here that first paragraph is a hit
+            if type(child) in TRANSLATABLE_BLOCK_TYPES:
+                translated_token = child
+                break
+        if translated_token is None:
+            raise RuntimeError(
+                "Something went wrong, we didn't get translation token back: \n%s"
+                % translated_markdown
+            )
+        if add_alt:
+            # Add back our alt text
+            translated_token.children[1].content = (
+                "{alt='" + translated_token.children[1].content
+            )
+            translated_token.children[-1].content = (
+                translated_token.children[-1].content + "'}"
+            )
+
+        token.children = translated_token.children
 
 
 def translate_block(
     token: BlockToken,
-    renderer=None,
+    renderer: MarkdownRenderer,
     ignore_triple_colon=True,
     ignore_galaxy_marker=True,
     source_lang="EN",
@@ -238,9 +511,22 @@ def translate_block(
     auth_key=None,
     char_count_only=True,
     translation_context=None,
+    skip_words=frozenset(),
+    use_cache=True,
+    check_credits=True,
+    extra_texts=None,
 ):
     """Update the text contents of paragraphs and headings within this block,
-    and recursively within its children."""
+    and recursively within its children. The block is updated in place and the
+    number of characters sent for translation is returned.
+
+    All the translatable blocks are collected first and then translated with a
+    single request, rather than making one request per paragraph/heading. Any
+    `extra_texts` (a list of plain strings, like the title of the document) are
+    sent in the same request and replaced in place by their translations.
+
+    The renderer is required (rather than created on demand) so that a single,
+    context-managed, instance is used for the whole document."""
 
     # First check some input arguments
     check_typical_arguments(
@@ -251,127 +537,48 @@ def translate_block(
         char_count_only=char_count_only,
     )
 
-    # We are only translating selected elements of the markdown
-    allowed_blocks = (Paragraph, Heading)
-
-    # Create a markdown renderer if we don't have one already
-    if renderer is None:
-        renderer = MarkdownRenderer(max_line_length=MAX_LINE_LENGTH)
-
-    # By default, just assume we return what we got and a char_count of 0
-    translated_token = token
-    char_count = 0
-
-    # if isinstance(token, (Paragraph, SetextHeading, Heading)):
-    if isinstance(token, allowed_blocks):
-        # Ignore any paragraph that starts with ':::' (this is Carpentries Workbench specific)
-        if (
-            ignore_triple_colon
-            and isinstance(token, Paragraph)
-            and isinstance(token.children[0], RawText)
-            and token.children[0].content.startswith(":::")
-        ):
-            pass
-        # Ignore any paragraph that starts with '{: ' (this is Galaxy specific)
-        elif (
-            ignore_galaxy_marker
-            and isinstance(token, Paragraph)
-            and isinstance(token.children[0], RawText)
-            and token.children[0].content.startswith("{: ")
-        ):
-            pass
-        else:
-            # If we have the alt text that is plain html and sits beside an image
-            # then let's chop the tags off and reinsert them later
-            add_alt = False
-            if len(token.children) > 1 and (
-                isinstance(token, Paragraph)
-                and isinstance(token.children[0], Image)
-                and isinstance(token.children[1], RawText)
-                and token.children[1].content.startswith("{alt='")
-                and isinstance(token.children[-1], RawText)
-                and token.children[-1].content.endswith("'}")
-            ):
-                add_alt = True
-                token.children[1].content = token.children[1].content.replace(
-                    "{alt='", ""
-                )
-                token.children[-1].content = token.children[-1].content.replace(
-                    "'}", ""
-                )
-            # Replace all the inline code blocks with placeholders
-            inline_code_dict = {}
-            for child in token.children:
-                replace_inline_code(child, inline_code_dict)
-            # Reconstruct the resulting markdown block to give a full context to translate
-            markdown_text = renderer.render(token)
-
-            # Translate the block using a specific machine translator
-            char_count, translated_markdown = translate_block_deepl(
-                markdown_text,
-                source_lang=source_lang,
-                target_lang=target_lang,
-                glossary=glossary,
-                auth_key=auth_key,
-                char_count_only=char_count_only,
-                translation_context=translation_context,
-            )
-
-            # Ensure inline code syntax is preserved
-            # (some failures are allowed, so we also may be updating the dictionary)
-            translated_markdown, inline_code_dict = ensure_inline_code_syntax(
-                translated_markdown, inline_code_dict=inline_code_dict
-            )
-
-            # Deconstruct the resulting markdown again and identify the token we need
-            temp_document = mistletoe.Document(translated_markdown)
-
-            for child in temp_document.children:
-                # Assuming here that first paragraph is a hit
-                if isinstance(child, allowed_blocks):
-                    translated_token = child
-                    break
-            if translated_token is None:
-                raise RuntimeError(
-                    "Something went wrong, we didn't get translation token back: \n%s"
-                    % renderer.render(temp_document)
-                )
-            # Replace all the placeholders with their inline codeblocks
-            for child in translated_token.children:
-                restore_inline_code(child, inline_code_dict)
-            if len(inline_code_dict):
-                print(markdown_text)
-                print(translated_markdown)
-                raise RuntimeError(
-                    "Something went wrong, you should have an empty dict after translation but you have: %s"
-                    % inline_code_dict
-                )
-            if add_alt:
-                # Add back our alt text
-                translated_token.children[1].content = (
-                    "{alt='" + translated_token.children[1].content
-                )
-                translated_token.children[-1].content = (
-                    translated_token.children[-1].content + "'}"
-                )
+    # Gather everything we need to translate
+    blocks = {
+        "tokens": [],
+        "markdown_texts": [],
+        "inline_code_dicts": [],
+        "add_alts": [],
+    }
+    with _MISTLETOE_LOCK:
+        _collect_blocks(
+            token,
+            blocks,
+            renderer,
+            ignore_triple_colon=ignore_triple_colon,
+            ignore_galaxy_marker=ignore_galaxy_marker,
+            skip_words=skip_words,
+        )
+    if extra_texts is None:
+        extra_texts = []
+    if not blocks["tokens"] and not extra_texts:
+        return 0
+
+    # Translate all the blocks using a specific machine translator
+    char_count, translated_markdowns = translate_block_deepl(
+        blocks["markdown_texts"] + extra_texts,
+        source_lang=source_lang,
+        target_lang=target_lang,
+        glossary=glossary,
+        auth_key=auth_key,
+        char_count_only=char_count_only,
+        translation_context=translation_context,
+        use_cache=use_cache,
+        check_credits=check_credits,
+    )
 
-    if hasattr(token, "children") and token.children is not None:
-        for index, child in enumerate(token.children):
-            if isinstance(child, BlockToken):
-                child_char_count, token.children[index] = translate_block(
-                    child,
-                    renderer=renderer,
-                    ignore_triple_colon=ignore_triple_colon,
-                    source_lang=source_lang,
-                    target_lang=target_lang,
-                    glossary=glossary,
-                    auth_key=auth_key,
-                    char_count_only=char_count_only,
-                    translation_context=translation_context,
-                )
-                char_count += child_char_count
+    # Put the translations back into the document
+    # (if we are only counting then the document is left exactly as it was)
+    if not char_count_only:
+        number_of_blocks = len(blocks["tokens"])
+        _apply_translations(blocks, translated_markdowns[:number_of_blocks], root=token)
+        extra_texts[:] = translated_markdowns[number_of_blocks:]
 
-    return char_count, translated_token
+    return char_count
 
 
 def check_typical_arguments(
@@ -388,17 +595,15 @@ def check_typical_arguments(
             % (target_lang, DEEPL_TARGET_LANGUAGES)
         )
     # Accepted languages
-    accepted_source_langs = [lang[0] for lang in DEEPL_SOURCE_LANGUAGES]
-    accepted_target_langs = [lang[0] for lang in DEEPL_TARGET_LANGUAGES]
-    if source_lang.upper() not in accepted_source_langs:
+    if source_lang.upper() not in ACCEPTED_SOURCE_LANGUAGES:
         raise ValueError(
             "Source language %s is not in the accepted options: %s"
-            % (source_lang, accepted_source_langs)
+            % (source_lang, sorted(ACCEPTED_SOURCE_LANGUAGES))
         )
-    if target_lang.upper() not in accepted_target_langs:
+    if target_lang.upper() not in ACCEPTED_TARGET_LANGUAGES:
         raise ValueError(
-            "Source language %s is not in the accepted options: %s"
-            % (target_lang, accepted_target_langs)
+            "Target language %s is not in the accepted options: %s"
+            % (target_lang, sorted(ACCEPTED_TARGET_LANGUAGES))
         )
     if source_lang.upper() == target_lang.upper():
         raise ValueError(
@@ -414,8 +619,8 @@ def check_typical_arguments(
 
     if glossary:
         if (
-            source_lang.upper() not in DEEPL_GLOSSARY_LANGUAGES
-            or target_lang.upper() not in DEEPL_GLOSSARY_LANGUAGES
+            source_lang.upper() not in ACCEPTED_GLOSSARY_LANGUAGES
+            or target_lang.upper() not in ACCEPTED_GLOSSARY_LANGUAGES
         ):
             raise ValueError(
                 "Glossaries only work between certain languages: %s"
@@ -441,16 +646,15 @@ def ensure_inline_code_syntax(translated_markdown, inline_code_dict={}):
     missed_keys = 0
     keys_to_pop = []
 
-    for key in inline_code_dict.keys():
-        # weird things with case can happen, let's fix that already
-        insensitive_key = re.compile(re.escape(key), re.IGNORECASE)
-        translated_markdown = insensitive_key.sub(key, translated_markdown)
-        if key not in translated_markdown:
+    # Find all the placeholders that survived translation in a single pass
+    found_keys = set(PLACEHOLDER_PATTERN.findall(translated_markdown))
+    for key in inline_code_dict:
+        if key not in found_keys:
             # Let's be a little forgiving here and raise a warning
             # but if it happens more than twice, make it an error
             msg = (
                 "Code placeholder %s (value %s) does not appear in translation:\n%s"
-                % (key, inline_code_dict[key], translated_markdown)
+                % (ascii(key), inline_code_dict[key], translated_markdown)
             )
             print("Warning %d:\n%s" % (missed_keys, msg))
             if missed_keys < 2:
@@ -461,14 +665,18 @@ def ensure_inline_code_syntax(translated_markdown, inline_code_dict={}):
                 raise RuntimeError(
                     "Too many warnings for missing code placeholders, exiting!"
                 )
-        location = translated_markdown.find(key)
-        translated_markdown = (
-            translated_markdown[: location - 1]
-            + "`"
-            + key
-            + "`"
-            + translated_markdown[location + len(key) + 1 :]
-        )
+
+    # The placeholders can't be merged into the surrounding words by the translator,
+    # so we only need to put back any backticks that went missing (other private use
+    # characters are part of the text and are left alone)
+    translated_markdown = UNQUOTED_PLACEHOLDER_PATTERN.sub(
+        lambda match: (
+            "`%s`" % match.group(1)
+            if match.group(1) in inline_code_dict
+            else match.group(1)
+        ),
+        translated_markdown,
+    )
 
     # We should never have an uneven number of backticks
     # If we do, it is likely due to two (or more) consecutive backticks
@@ -477,7 +685,9 @@ def ensure_inline_code_syntax(translated_markdown, inline_code_dict={}):
         translated_markdown = re.sub(r"`+", "`", translated_markdown)
         # if we still have an uneven number then we have an error
         if translated_markdown.count("`") % 2 != 0:
-            raise RuntimeError("Uneven number of backticks in translation:\n%s")
+            raise RuntimeError(
+                "Uneven number of backticks in translation:\n%s" % translated_markdown
+            )
     # If we allowed some key misses, pop them from the dictionary
     for key in keys_to_pop:
         inline_code_dict.pop(key)
@@ -485,13 +695,15 @@ def ensure_inline_code_syntax(translated_markdown, inline_code_dict={}):
 
 
 def translate_block_deepl(
-    markdown_text,
+    markdown_texts,
     source_lang="EN",
     target_lang=None,
     auth_key=None,
     glossary={},
     char_count_only=False,
     translation_context=None,
+    use_cache=True,
+    check_credits=True,
 ):
     check_typical_arguments(
         source_lang=source_lang,
@@ -500,53 +712,119 @@ def translate_block_deepl(
         auth_key=auth_key,
         char_count_only=char_count_only,
     )
-    if len(markdown_text) == 0:
-        return markdown_text
+    if len(markdown_texts) == 0:
+        return 0, []
+
+    # Starting or ending with special markdown syntax seems to cause syntax loss, so we
+    # wrap each block in a tag (and protect the inline code) using DeepL's XML handling
+    markdown_texts_to_translate = [
+        add_translation_markup(markdown_text) for markdown_text in markdown_texts
+    ]
+
+    # Translate the resulting markdown texts (all in one request)
+    char_count = count_characters_to_translate(
+        markdown_texts_to_translate,
+        source_lang=source_lang,
+        target_lang=target_lang,
+        glossary=glossary,
+        tag_handling="xml",
+        use_cache=use_cache,
+    )
+    if char_count_only:
+        # Nothing to translate, so nothing to undo either
+        return char_count, markdown_texts
+    translated_markdowns = translate_deepl(
+        markdown_texts_to_translate,
+        source_lang=source_lang,
+        target_lang=target_lang,
+        glossary=glossary,
+        auth_key=auth_key,
+        translation_context=translation_context,
+        tag_handling="xml",
+        use_cache=use_cache,
+        check_credits=check_credits,
+    )
+
+    return char_count, [
+        remove_translation_markup(translated_markdown)
+        for translated_markdown in translated_markdowns
+    ]
+
 
-    # Starting or ending with special markdown syntax seems to cause syntax loss, so let's work around that by
-    # adding something that can't get translated
-    # - leaving a '.' at the end can sometimes cause DeepL to remove the subsequent space
-    # - Left a space as you don't want to mess with the first/last word
-    markdown_text_to_translate = (
-        START_MARKER + ":: " + markdown_text + " ::" + END_MARKER
+def add_translation_markup(markdown_text):
+    # Escape anything that would otherwise be interpreted as XML
+    markdown_text = xml.sax.saxutils.escape(markdown_text)
+    # The translator should leave inline code (including the backticks) untouched
+    markdown_text = INLINE_CODE_PATTERN.sub(
+        IGNORE_START_TAG + r"\g<0>" + IGNORE_END_TAG, markdown_text
     )
+    return BLOCK_START_TAG + markdown_text + BLOCK_END_TAG
 
-    # Translate the resulting markdown text
-    char_count = len(markdown_text_to_translate)
-    if char_count_only:
-        translated_markdown = markdown_text_to_translate
-    else:
-        translated_markdown = translate_deepl(
-            markdown_text_to_translate,
-            source_lang=source_lang,
-            target_lang=target_lang,
-            glossary=glossary,
-            auth_key=auth_key,
-            translation_context=translation_context,
-        )
+
+def remove_translation_markup(translated_markdown):
+    # The block tag is at known positions, so we can just slice it off
     translated_markdown = translated_markdown.strip()
+    if translated_markdown.startswith(BLOCK_START_TAG):
+        translated_markdown = translated_markdown[len(BLOCK_START_TAG) :]
+    if translated_markdown.endswith(BLOCK_END_TAG):
+        translated_markdown = translated_markdown[: -len(BLOCK_END_TAG)]
+    # The inline code tags can be anywhere
+    translated_markdown = translated_markdown.replace(IGNORE_START_TAG, "")
+    translated_markdown = translated_markdown.replace(IGNORE_END_TAG, "")
+    translated_markdown = xml.sax.saxutils.unescape(
+        translated_markdown, XML_UNESCAPE_ENTITIES
+    )
 
-    # Remove our markers from the translated text
-    if translated_markdown.startswith(START_MARKER):
-        translated_markdown = translated_markdown.replace(START_MARKER, "")
-        # Now we also need to remove the colons (and don't worry about spaces)
-        translated_markdown = translated_markdown.lstrip(":")
-    else:
-        raise RuntimeError(
-            "Translated markdown does not have our start signature (%s): %s"
-            % (start_marker, translated_markdown)
-        )
-    if translated_markdown.endswith(END_MARKER):
-        translated_markdown = translated_markdown.replace(END_MARKER, "")
-        # Now we also need to remove the colons (and don't worry about spaces)
-        translated_markdown = translated_markdown.rstrip(":")
-    else:
-        raise RuntimeError(
-            "Translated markdown does not have our end signature (%s): %s"
-            % (end_marker, translated_markdown)
+    return translated_markdown.strip()
+
+
+@functools.lru_cache(maxsize=1)
+def _get_translator(auth_key):
+    # Creating a translator is not free (and each one has its own connection pool),
+    # so we reuse the same one for all our requests (and let DeepL know who we are)
+    return deepl.Translator(auth_key).set_app_info("translate_md", "0.1.0")
+
+
+_GLOSSARY_LOCK = threading.Lock()
+
+
+def _get_glossary(translator, source_lang, target_lang, glossary):
+    # Creating (and deleting) a DeepL glossary costs two round-trips, so we only
+    # create one for each set of entries and keep it around until we exit
+    with _GLOSSARY_LOCK:
+        return _create_glossary(
+            translator,
+            source_lang.upper(),
+            target_lang.upper(),
+            frozenset(glossary.items()),
         )
 
-    return char_count, translated_markdown
+
+@functools.lru_cache(maxsize=None)
+def _create_glossary(translator, source_lang, target_lang, entries):
+    deepl_glossary = translator.create_glossary(
+        "Temporary glossary",
+        source_lang=source_lang,
+        target_lang=target_lang,
+        entries=dict(entries),
+    )
+    atexit.register(translator.delete_glossary, deepl_glossary)
+    return deepl_glossary
+
+
+def _check_credits(translator, total_characters, usage=None):
+    # The usage query is an extra round-trip to DeepL so we skip it if we are given a
+    # usage we already queried
+    if usage is None:
+        usage = translator.get_usage()
+    if usage.any_limit_reached:
+        raise RuntimeError("Translation limit reached on DeepL :( ")
+    if usage.character.valid:
+        if total_characters > usage.character.limit - usage.character.count:
+            raise RuntimeError(
+                f"Character usage: {usage.character.count} of {usage.character.limit}, need {total_characters} for "
+                f"translation!"
+            )
 
 
 def translate_deepl(
@@ -556,6 +834,9 @@ def translate_deepl(
     glossary=None,
     auth_key=None,
     translation_context=None,
+    tag_handling=None,
+    use_cache=True,
+    check_credits=True,
 ):
     check_typical_arguments(
         source_lang=source_lang,
@@ -567,57 +848,204 @@ def translate_deepl(
 
     if not auth_key:
         raise ValueError("You must provide a valid authentication key to use DeepL!")
-    translator = deepl.Translator(auth_key)
+    translator = _get_translator(auth_key)
 
-    # Make sure we have enough credits for the full translation
-    total_characters = len(text)
-    usage = translator.get_usage()
-    if usage.any_limit_reached:
-        raise RuntimeError("Translation limit reached on DeepL :( ")
-    if usage.character.valid:
-        if total_characters > usage.character.limit - usage.character.count:
-            raise RuntimeError(
-                f"Character usage: {usage.character.count} of {usage.character.limit}, need {total_characters} for "
-                f"translation!"
-            )
+    # We can be given a single text or a list of texts to translate in one request
+    texts = [text] if isinstance(text, str) else text
+
+    # Identical texts (boilerplate, admonition titles, ...) only need to be translated
+    # once, and anything we have translated before is in our cache
+    translations, cache_keys = lookup_cached_translations(
+        texts,
+        source_lang=source_lang,
+        target_lang=target_lang,
+        glossary=glossary,
+        tag_handling=tag_handling,
+        use_cache=use_cache,
+    )
+    texts_to_translate = [
+        item for item, translation in translations.items() if translation is None
+    ]
+
+    if texts_to_translate:
+        # Make sure we have enough credits for the full translation
+        # (unless our caller already checked for all of its translations)
+        if check_credits:
+            total_characters = sum(map(len, texts_to_translate))
+            _check_credits(translator, total_characters)
+        deepl_glossary = (
+            _get_glossary(translator, source_lang, target_lang, glossary)
+            if glossary
+            else None
+        )
+
+        # DeepL limits the size of a request, so split them up and send the requests
+        # in parallel (the translator is thread-safe)
+        chunks = split_into_requests(texts_to_translate)
+        translate_chunk = functools.partial(
+            _translate_text_deepl,
+            translator,
+            source_lang=source_lang,
+            target_lang=target_lang,
+            glossary=deepl_glossary,
+            translation_context=translation_context,
+            tag_handling=tag_handling,
+        )
+        if len(chunks) == 1:
+            # No need for any threads if it is a single request
+            results = [translate_chunk(chunks[0])]
+        else:
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(MAX_PARALLEL_REQUESTS, len(chunks))
+            ) as executor:
+                results = list(executor.map(translate_chunk, chunks))
+        for chunk, chunk_results in zip(chunks, results):
+            for item, translation in zip(chunk, chunk_results):
+                translations[item] = translation
+
+        with _TRANSLATION_CACHE_LOCK, shelve.open(TRANSLATION_CACHE_FILE) as cache:
+            for item in texts_to_translate:
+                cache[cache_keys[item]] = translations[item]
+
+    if isinstance(text, str):
+        return translations[text]
+    return [translations[item] for item in texts]
+
+
+def lookup_cached_translations(
+    texts,
+    source_lang="EN",
+    target_lang=None,
+    glossary=None,
+    tag_handling=None,
+    use_cache=True,
+):
+    """Return a dict mapping each unique text to its cached translation (None if we
+    don't have one) and a dict with the cache key for each text."""
+    translations = dict.fromkeys(texts)
+    glossary_id = (
+        hashlib.sha256(repr(sorted(glossary.items())).encode("utf-8")).hexdigest()
+        if glossary
+        else ""
+    )
+    cache_keys = {
+        item: hashlib.sha256(
+            (
+                source_lang.upper()
+                + target_lang.upper()
+                + glossary_id
+                + (tag_handling or "")
+                + item
+            ).encode("utf-8")
+        ).hexdigest()
+        for item in translations
+    }
+    if use_cache:
+        with _TRANSLATION_CACHE_LOCK:
+            try:
+                # Only read, we don't want to create a cache if we're only counting
+                with shelve.open(TRANSLATION_CACHE_FILE, flag="r") as cache:
+                    for item in translations:
+                        translations[item] = cache.get(cache_keys[item])
+            except dbm.error:
+                # No cache yet
+                pass
+
+    return translations, cache_keys
+
+
+def count_characters_to_translate(
+    texts,
+    source_lang="EN",
+    target_lang=None,
+    glossary=None,
+    tag_handling=None,
+    use_cache=True,
+):
+    """Count the characters we would need to send to the translator for these texts
+    (duplicates and anything we have already translated are free)."""
+    translations, _ = lookup_cached_translations(
+        texts,
+        source_lang=source_lang,
+        target_lang=target_lang,
+        glossary=glossary,
+        tag_handling=tag_handling,
+        use_cache=use_cache,
+    )
+    return sum(
+        len(item) for item, translation in translations.items() if translation is None
+    )
+
+
+def split_into_requests(
+    texts,
+    max_characters=DEEPL_MAX_REQUEST_CHARACTERS,
+    max_texts=DEEPL_MAX_REQUEST_TEXTS,
+):
+    # Greedily group the texts (in order) so that each request stays within the
+    # limits, a text that is too long on its own gets a request to itself
+    chunks = []
+    chunk = []
+    chunk_characters = 0
+    for text in texts:
+        if chunk and (
+            chunk_characters + len(text) > max_characters or len(chunk) == max_texts
+        ):
+            chunks.append(chunk)
+            chunk = []
+            chunk_characters = 0
+        chunk.append(text)
+        chunk_characters += len(text)
+    if chunk:
+        chunks.append(chunk)
+
+    return chunks
+
+
+def _translate_text_deepl(
+    translator,
+    texts,
+    source_lang="EN",
+    target_lang=None,
+    glossary=None,
+    translation_context=None,
+    tag_handling=None,
+):
     # Configure kwargs for translator
     translator_kwargs = {
         "source_lang": source_lang.upper(),
         "target_lang": target_lang.upper(),
         "preserve_formatting": True,
     }
+    if tag_handling == "xml":
+        # Anything inside our ignore tag is left untouched
+        translator_kwargs["tag_handling"] = "xml"
+        translator_kwargs["ignore_tags"] = [IGNORE_TAG]
     if glossary:
-        # Create the DeepL glossary from the given dict
-        temp_glossary = translator.create_glossary(
-            "Temporary glossary",
-            source_lang=source_lang.upper(),
-            target_lang=target_lang.upper(),
-            entries=glossary,
-        )
-        translator_kwargs["glossary"] = temp_glossary
+        # This is a DeepL glossary (see _get_glossary)
+        translator_kwargs["glossary"] = glossary
 
     # Add translation context if we have some
     if translation_context:
         # There's a limit on how big a request can be but let's just give as much context as possible
-        characters_to_send = min(
-            (MAX_TRANSLATION_CONTEXT - total_characters), len(translation_context)
-        )
-        translator_kwargs["context"] = translation_context[:characters_to_send]
-
-    result = translator.translate_text(text, **translator_kwargs).text
+        # (the context was already capped when it was created, so usually it all fits)
+        characters_to_send = MAX_TRANSLATION_CONTEXT - sum(map(len, texts))
+        if characters_to_send >= len(translation_context):
+            translator_kwargs["context"] = translation_context
+        elif characters_to_send > 0:
+            translator_kwargs["context"] = translation_context[:characters_to_send]
 
-    # Delete the temporary glossary
-    if glossary:
-        translator.delete_glossary(temp_glossary)
+    with _DEEPL_REQUEST_SLOTS:
+        results = translator.translate_text(texts, **translator_kwargs)
 
-    return result
+    return [result.text for result in results]
 
 
 def avail_char_quota_deepl(auth_key=None):
     # Check available character quota
-    translator = deepl.Translator(auth_key)
     available_characters = -1
     if auth_key:
+        translator = _get_translator(auth_key)
         usage = translator.get_usage()
         available_characters = usage.character.limit - usage.character.count
     else:
@@ -626,8 +1054,17 @@ def avail_char_quota_deepl(auth_key=None):
     return available_characters
 
 
-def extract_frontmatter_dict(markdown_file):
-    return frontmatter.load(markdown_file).metadata
+def extract_frontmatter_dict(markdown_content):
+    # Most files have no front matter, so only bother parsing it if it is there
+    # (and only if it is the front matter we would remove)
+    match = FRONT_MATTER_PATTERN.match(markdown_content)
+    if not match:
+        return {}
+    if match.group(1) == "---":
+        # YAML, which we can parse directly from what we matched
+        metadata = yaml.load(match.group(2), Loader=YAML_LOADER)
+        return metadata if isinstance(metadata, dict) else {}
+    return frontmatter.loads(markdown_content).metadata
 
 
 def create_frontmatter_string(frontmatter_dict):
@@ -637,6 +1074,7 @@ def create_frontmatter_string(frontmatter_dict):
             "---\n"
             + yaml.dump(
                 frontmatter_dict,
+                Dumper=YAML_DUMPER,
                 sort_keys=False,
                 default_flow_style=False,
                 allow_unicode=True,
@@ -649,21 +1087,7 @@ def create_frontmatter_string(frontmatter_dict):
 
 def text_line(line):
     """Remove extraneous Markdown characters."""
-
-    rep = (
-        ("**", " "),
-        ("__", " "),
-    )
-
-    for a, b in rep:
-        line = line.replace(a, b)
-
-    lstrip = ("#", ":", "-", "*", "`", "-", "{", "}")
-
-    for lstr in lstrip:
-        line = line.lstrip(lstr)
-
-    return line.strip()
+    return EMPHASIS_PATTERN.sub(" ", line).lstrip(TEXT_LINE_LSTRIP_CHARS).strip()
 
 
 def translate_markdown_file(
@@ -675,6 +1099,11 @@ def translate_markdown_file(
     auth_key=None,
     char_count_only=True,
     ignore_triple_colon=True,
+    skip_words=frozenset(),
+    use_cache=True,
+    check_credits=True,
+    renderer=None,
+    markdown_content=None,
 ):
     check_typical_arguments(
         source_lang=source_lang,
@@ -686,94 +1115,413 @@ def translate_markdown_file(
     # Make sure the file exists and has a recognised extension
     if not os.path.isfile(markdown_file):
         raise ValueError("Input markdown file %s does not exist!" % markdown_file)
-    md_extension = pathlib.Path(markdown_file).suffix
+    md_extension = os.path.splitext(markdown_file)[1]
     if md_extension.lower() not in ACCEPTED_MARKDOWN_FILE_EXTENSIONS:
-        print(md_extension.lower())
         raise ValueError(
-            "File %s does not have an extension in the accepted list (): %s"
-            % (markdown_file, ACCEPTED_MARKDOWN_FILE_EXTENSIONS)
+            "File %s has extension '%s' which is not in the accepted list: %s"
+            % (markdown_file, md_extension, ACCEPTED_MARKDOWN_FILE_EXTENSIONS)
         )
 
+    # Read the file once (unless we were given its contents), everything else works on
+    # its contents
+    if markdown_content is None:
+        with open(markdown_file, "r") as fin:
+            markdown_content = fin.read()
+
     # Extract the front matter
-    frontmatter_dict = extract_frontmatter_dict(markdown_file)
+    frontmatter_dict = extract_frontmatter_dict(markdown_content)
+
+    # We can also now remove the frontmatter from the contents
+    markdown_content = remove_front_matter(markdown_content)
 
     # People may not be careful with ::: syntax (and forget to/ leave blank lines)
-    temp_markdown_file = surround_special_syntax_with_correct_separation(markdown_file)
+    markdown_lines = surround_special_syntax_with_correct_separation(
+        markdown_content.splitlines(keepends=True)
+    )
 
-    # We can also now remove the frontmatter from this file
-    remove_front_matter_from_file(temp_markdown_file)
+    # Let's get some translation context
+    # (removing extraneous characters)
+    translation_context = []
+    chars = 0
 
-    with open(temp_markdown_file, "r") as fin:
-        # Let's get some translation context
-        # (removing extraneous characters)
-        translation_context = []
-        chars = 0
+    for line in markdown_lines:
+        line = text_line(line)
 
-        for line in fin:
-            line = text_line(line)
+        if not line:
+            continue
 
-            if not line:
-                continue
+        # +1 is the newline char
+        if (chars := chars + len(line) + 1) > MAX_TRANSLATION_CONTEXT:
+            break
 
-            # +1 is the newline char
-            if (chars := chars + len(line) + 1) > MAX_TRANSLATION_CONTEXT:
-                break
+        translation_context.append(line)
 
-            translation_context.append(line)
-
-        translation_context = "\n".join(translation_context)
-
-        # Rewind the file
-        fin.seek(0)
-
-        # Use a renderer with massive line length for the translation so that we never have line breaks in paragraphs
-        with MarkdownRenderer(max_line_length=MAX_LINE_LENGTH) as renderer:
-            document = mistletoe.Document(fin)
-            char_count, translated_document = translate_block(
-                document,
-                renderer=renderer,
-                source_lang=source_lang,
-                target_lang=target_lang,
-                glossary=glossary,
-                auth_key=auth_key,
-                char_count_only=char_count_only,
-                ignore_triple_colon=ignore_triple_colon,
-                translation_context=translation_context,
-            )
-    # Also translate the title if it exists
-    if "title" in frontmatter_dict:
-        if char_count_only:
-            char_count += len(frontmatter_dict["title"])
-        else:
-            frontmatter_dict["title"] = translate_deepl(
-                frontmatter_dict["title"],
-                source_lang=source_lang,
-                target_lang=target_lang,
-                glossary=glossary,
-                auth_key=auth_key,
-                translation_context=translation_context,
+    translation_context = "\n".join(translation_context)
+
+    # Use a renderer with massive line length for the translation so that we never have
+    # line breaks in paragraphs (and the same renderer for the final output)
+    if renderer is None:
+        renderer_context = MarkdownRenderer(max_line_length=MAX_LINE_LENGTH)
+    else:
+        renderer_context = contextlib.nullcontext(renderer)
+    with renderer_context as renderer:
+        with _MISTLETOE_LOCK:
+            document = mistletoe.Document(markdown_lines)
+        # Also translate the title if it exists (in the same request as the rest)
+        titles = []
+        if isinstance(frontmatter_dict.get("title"), str):
+            titles.append(frontmatter_dict["title"])
+        char_count = translate_block(
+            document,
+            renderer=renderer,
+            source_lang=source_lang,
+            target_lang=target_lang,
+            glossary=glossary,
+            auth_key=auth_key,
+            char_count_only=char_count_only,
+            ignore_triple_colon=ignore_triple_colon,
+            translation_context=translation_context,
+            skip_words=skip_words,
+            use_cache=use_cache,
+            check_credits=check_credits,
+            extra_texts=titles,
+        )
+        if titles:
+            frontmatter_dict["title"] = titles[0]
+        if not char_count_only or output_file:
+
+            if output_file:
+                # Let's work with full paths
+                output_file_path = os.path.abspath(output_file)
+                os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
+                output_context = open(output_file_path, "w")
+            else:
+                output_context = contextlib.nullcontext(sys.stdout)
+
+            with output_context as md_output_dest:
+                if frontmatter_dict:
+                    print(
+                        create_frontmatter_string(frontmatter_dict), file=md_output_dest
+                    )
+                # Use a shorter line length for the final rendering, and write the
+                # lines out as they are rendered (rather than building one big string)
+                for line in renderer.render_map[document.__class__.__name__](
+                    document, max_line_length=OUTPUT_LINE_LENGTH
+                ):
+                    md_output_dest.write(line + "\n")
+                md_output_dest.write("\n")
+
+    return char_count
+
+
+def output_file_name(
+    markdown_file,
+    target_lang=None,
+    output_subdir=False,
+    output_suffix=False,
+    output_suffix_char="_",
+):
+    """Construct the output file name/location for a markdown file (None means the
+    translation goes to stdout)."""
+    if output_subdir:
+        split_path = os.path.split(markdown_file)
+        return os.path.join(split_path[0], target_lang, split_path[1])
+    elif output_suffix:
+        # Split on the extension this time
+        split_path = os.path.splitext(markdown_file)
+        return (
+            split_path[0] + "%s%s" % (output_suffix_char, target_lang) + split_path[1]
+        )
+    return None
+
+
+def is_output_file_name(
+    markdown_file,
+    output_subdir=False,
+    output_suffix=False,
+    output_suffix_char="_",
+):
+    """Check if a markdown file is where we would put the translation of another file
+    into any of our target languages (see `output_file_name`)."""
+    if output_subdir:
+        parent_dir = os.path.basename(os.path.dirname(markdown_file))
+        return parent_dir.upper() in ACCEPTED_TARGET_LANGUAGES
+    elif output_suffix:
+        file_name = os.path.splitext(os.path.basename(markdown_file))[0]
+        _, separator, language = file_name.rpartition(output_suffix_char)
+        return bool(separator) and language.upper() in ACCEPTED_TARGET_LANGUAGES
+    return False
+
+
+@functools.lru_cache(maxsize=8)
+def read_glossary_file(glossary_file, mtime=None):
+    """Turn a csv glossary file into a dict with source lang term as key and target
+    lang term as value. The result is cached (`mtime` is part of the key so that a
+    modified file is read again), so it must not be modified."""
+    with open(glossary_file, mode="r") as infile:
+        reader = csv.reader(infile)
+        # Skip anything that isn't a term pair (e.g. blank lines)
+        return dict(row[:2] for row in reader if len(row) >= 2)
+
+
+def content_digest(content):
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def translation_settings_id(source_lang, target_lang, glossary, skip_words=()):
+    # Anything that changes the translation of a file
+    settings = (source_lang.upper(), target_lang.upper(), sorted(glossary.items()))
+    if skip_words:
+        # (only when there are some, so that existing state remains valid)
+        settings += (sorted(skip_words),)
+    return hashlib.sha256(repr(settings).encode("utf-8")).hexdigest()
+
+
+def load_translation_state(state_file=TRANSLATION_STATE_FILE):
+    """Load the state of our translations, a dict with an entry for each output file
+    (a file translated into several languages has an entry for each of them)."""
+    try:
+        with open(state_file, "r") as fin:
+            translation_state = json.load(fin)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    for key, file_state in list(translation_state.items()):
+        # Older state files had a single entry for each input file (keyed by the input)
+        if "input" not in file_state:
+            del translation_state[key]
+            if file_state.get("output"):
+                translation_state[file_state["output"]] = dict(file_state, input=key)
+    return translation_state
+
+
+def save_translation_state(translation_state, state_file=TRANSLATION_STATE_FILE):
+    # Write to a temporary file first so the state is never left half written
+    temp_file = state_file + ".tmp"
+    with open(temp_file, "w") as fout:
+        json.dump(translation_state, fout, indent=2, sort_keys=True)
+    os.replace(temp_file, state_file)
+
+
+def translate_markdown_file_list(
+    markdown_files,
+    source_lang="EN",
+    target_lang=None,
+    output_subdir=False,
+    output_suffix=False,
+    output_suffix_char="_",
+    char_count_only=True,
+    glossary={},
+    auth_key=None,
+    no_cache=False,
+    parallel=MAX_PARALLEL_FILES,
+    skip_words=(),
+):
+    """Translate (or count the characters to translate in) a list of markdown files,
+    this is what the command line does once it has found the files and read the
+    glossary. Long-running callers can read their glossary once and reuse it.
+
+    Returns the total number of characters required and used for the translation."""
+
+    # Add special syntax used by Galaxy so it is never at risk of translation/modification
+    # (this builds a new dict, the glossary we are given is left alone)
+    glossary = {**glossary, **GALAXY_SYNTAX_GLOSSARY}
+
+    # Make sure the output options are compatible
+    if output_subdir and output_suffix:
+        raise ValueError(
+            "You must chose between setting a subdirectory for output "
+            "('output_subdir', resulting in 'path/to/example/es/example.md') or "
+            "adding a suffix to the original file name "
+            "('output_suffix', resulting in 'path/to/example/example_es.md')"
+        )
+
+    # How we construct the output file name/location is the same for every file
+    output_file_for = functools.partial(
+        output_file_name,
+        target_lang=target_lang,
+        output_subdir=output_subdir,
+        output_suffix=output_suffix,
+        output_suffix_char=output_suffix_char,
+    )
+
+    # Files we have already translated (with the same settings) can be skipped if
+    # they haven't changed since (unless we are told not to, but we still need the
+    # state of all the other files so that we only update the files we translate)
+    translation_state = load_translation_state()
+    skip_words = frozenset(skip_words)
+    translation_settings = translation_settings_id(
+        source_lang, target_lang, glossary, skip_words=skip_words
+    )
+    translation_state_lock = threading.Lock()
+    markdown_contents = {}
+
+    def translate_one_markdown_file(
+        markdown_file, char_count_only=char_count_only, quiet=False
+    ):
+        output_file = output_file_for(markdown_file)
+
+        if output_file:
+            # If the file hasn't been touched since we last translated it (with the
+            # same settings) then we don't even need to read it
+            file_stat = os.stat(markdown_file)
+            previous_state = translation_state.get(output_file, {})
+            up_to_date = (
+                not no_cache
+                and previous_state.get("input") == markdown_file
+                and previous_state.get("settings") == translation_settings
+                and os.path.isfile(output_file)
             )
-    if not char_count_only or output_file:
+            if (
+                up_to_date
+                and previous_state.get("mtime") == file_stat.st_mtime_ns
+                and previous_state.get("size") == file_stat.st_size
+            ):
+                if not quiet:
+                    print(
+                        "%s: Unchanged since last translation, skipping" % markdown_file
+                    )
+                return 0
+
+        # Files are read once, even though they may be processed twice (when counting
+        # the characters up front and then when translating)
+        if markdown_file not in markdown_contents:
+            with open(markdown_file, "r") as fin:
+                markdown_contents[markdown_file] = fin.read()
+        markdown_content = markdown_contents[markdown_file]
 
         if output_file:
-            # Let's work with full paths
-            output_file_path = os.path.abspath(output_file)
-            try:
-                os.makedirs(os.path.dirname(output_file_path))
-            except FileExistsError:
-                pass
-            md_output_dest = open(output_file_path, "w")
-        else:
-            md_output_dest = sys.stdout
+            file_state = {
+                "digest": content_digest(markdown_content),
+                "input": markdown_file,
+                "output": output_file,
+                "settings": translation_settings,
+                "mtime": file_stat.st_mtime_ns,
+                "size": file_stat.st_size,
+            }
+            # The file may have been touched without its contents changing
+            if up_to_date and previous_state.get("digest") == file_state["digest"]:
+                if not quiet:
+                    print(
+                        "%s: Unchanged since last translation, skipping" % markdown_file
+                    )
+                if not char_count_only:
+                    with translation_state_lock:
+                        translation_state[output_file] = file_state
+                        save_translation_state(translation_state)
+                return 0
 
-        # Use a shorter line length for the final rendering
-        with MarkdownRenderer(max_line_length=OUTPUT_LINE_LENGTH) as short_renderer:
-            md = short_renderer.render(translated_document)
-            if frontmatter_dict:
-                print(create_frontmatter_string(frontmatter_dict), file=md_output_dest)
-            print(md, file=md_output_dest)
+        char_count = translate_markdown_file(
+            markdown_file,
+            # Nothing to write if we are only counting
+            output_file=None if char_count_only else output_file,
+            source_lang=source_lang,
+            target_lang=target_lang,
+            glossary=glossary,
+            auth_key=auth_key,
+            char_count_only=char_count_only,
+            skip_words=skip_words,
+            use_cache=not no_cache,
+            # We check the credits for all the files at once
+            check_credits=False,
+            renderer=renderer,
+            markdown_content=markdown_content,
+        )
 
-    return char_count
+        if output_file and not char_count_only:
+            with translation_state_lock:
+                translation_state[output_file] = file_state
+                save_translation_state(translation_state)
+
+        return char_count
+
+    # Not let's do the work
+    # (files are translated in parallel, unless the translations are all being
+    # written to stdout in which case we need to keep them in order)
+    if not char_count_only and not (output_subdir or output_suffix):
+        max_workers = 1
+    else:
+        max_workers = parallel
+    total_characters_required = 0
+    total_characters_used = 0
+    if auth_key:
+        # This usage is also what we check our credits against
+        usage = _get_translator(auth_key).get_usage()
+        pre_avail_quota = usage.character.limit - usage.character.count
+    else:
+        usage = None
+        pre_avail_quota = -1
+    # All the files share a single renderer (creating one registers its token types
+    # with mistletoe globally, and leaving its context resets them)
+    with MarkdownRenderer(max_line_length=MAX_LINE_LENGTH) as renderer:
+        if not char_count_only and auth_key:
+            # Check that we have the credits for all the files up front
+            # (without a key the translation itself will raise an error)
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=parallel
+            ) as executor:
+                characters_required = sum(
+                    executor.map(
+                        functools.partial(
+                            translate_one_markdown_file,
+                            char_count_only=True,
+                            quiet=True,
+                        ),
+                        markdown_files,
+                    )
+                )
+            _check_credits(_get_translator(auth_key), characters_required, usage=usage)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            char_counts = executor.map(translate_one_markdown_file, markdown_files)
+            for markdown_file, char_count in zip(markdown_files, char_counts):
+                total_characters_required += char_count
+                if char_count_only:
+                    if pre_avail_quota == -1:
+                        quota = "Unknown"
+                    else:
+                        quota = "%d" % pre_avail_quota
+                    print(
+                        "%s: Translation would use %d characters, available quota is %s"
+                        % (markdown_file, char_count, quota)
+                    )
+                    if 0 < pre_avail_quota < char_count:
+                        print(
+                            "You would not have enough quota to carry out this translation!",
+                            file=sys.stderr,
+                        )
+                else:
+                    print(
+                        "%s: Translation required %d characters"
+                        % (markdown_file, char_count)
+                    )
+    if not char_count_only:
+        # Files are translated concurrently, so we can only measure the quota usage
+        # for the whole set
+        post_avail_quota = avail_char_quota_deepl(auth_key=auth_key)
+        total_characters_used = pre_avail_quota - post_avail_quota
+        print(
+            "Translation used %d characters, you have %d quota remaining"
+            % (total_characters_used, post_avail_quota)
+        )
+        if total_characters_used > int(1.1 * total_characters_required):
+            print(
+                "Expected quota usage (%d) larger than estimated (%d)! "
+                % (total_characters_used, total_characters_required),
+                file=sys.stderr,
+            )
+    if len(markdown_files) > 1:
+        print(
+            "Total characters required for translation: %d" % total_characters_required
+        )
+        # Each file may fit in the quota while the whole set does not
+        if char_count_only and 0 < pre_avail_quota < total_characters_required:
+            print(
+                "You would not have enough quota to translate all of these files!",
+                file=sys.stderr,
+            )
+        if total_characters_used:
+            print("Total characters used: %d" % total_characters_used)
+
+    return total_characters_required, total_characters_used
 
 
 @click.command()
@@ -841,6 +1589,30 @@ def translate_markdown_file(
 @click.option(
     "--authentication-key", help="Authentication key for translation API", type=str
 )
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    default=False,
+    help="Flag to indicate if we should ignore previously cached translations and "
+    "translate files even if they are unchanged since their last translation (new "
+    "translations are still cached)",
+    show_default=True,
+)
+@click.option(
+    "--skip-word",
+    "skip_words",
+    multiple=True,
+    help="Text of a paragraph or heading that should be left untranslated (e.g. "
+    "'TODO'), can be given multiple times",
+    type=str,
+)
+@click.option(
+    "--parallel",
+    default=MAX_PARALLEL_FILES,
+    help="Number of files to translate at the same time",
+    type=click.IntRange(min=1),
+    show_default=True,
+)
 def translate_markdown_files(
     input_markdown_filestring,
     source_lang="EN",
@@ -851,123 +1623,61 @@ def translate_markdown_files(
     char_count_only=True,
     glossary_file=None,
     authentication_key=None,
+    no_cache=False,
+    parallel=MAX_PARALLEL_FILES,
+    skip_words=(),
 ):
     # Check our authentication key
     check_auth_key(authentication_key, error_only=False)
 
     # First gather our file list
-    markdown_files = glob.glob(input_markdown_filestring)
+    # (glob already uses os.scandir, and we allow '**' so a whole tree can be matched
+    # with a single pattern)
+    # (but not our own translations from earlier runs into any language, otherwise a
+    # pattern like '**/*.md' would have us translate those again, into ever deeper
+    # subdirectories, so we leave out every output we have a record of and anything
+    # that looks like one)
+    translation_outputs = {
+        os.path.normpath(file_state["output"])
+        for file_state in load_translation_state().values()
+        if file_state.get("output")
+    }
+    markdown_files = sorted(
+        markdown_file
+        for markdown_file in glob.iglob(input_markdown_filestring, recursive=True)
+        if os.path.normpath(markdown_file) not in translation_outputs
+        and not is_output_file_name(
+            markdown_file,
+            output_subdir=output_subdir,
+            output_suffix=output_suffix,
+            output_suffix_char=output_suffix_char,
+        )
+    )
     if not markdown_files:
         raise ValueError(
             "Your markdown matching string ('%s') did not match any files accessible from the current directory."
             % input_markdown_filestring
         )
 
-    # TODO: Be clever with git
-    # - Check if we're in git repo
-    # - Retain a hidden json file in the repo that contains markdown_file (as key), outputFile and
-    #   commit (within dict) from which they were created
-    # - read the json and check if the file has been touched since the commit
-    #   (if not, we don't need to do anything)
-    # - filter the list of files to translate accordingly
-    # - if we do translate, update the json with the new info
-
     if glossary_file:
-        # Need to turn our csv glossary file into a dict with source lang term as key
-        # and target lang term as value
-        with open(glossary_file, mode="r") as infile:
-            reader = csv.reader(infile)
-            glossary = {rows[0]: rows[1] for rows in reader}
+        glossary = read_glossary_file(glossary_file, os.path.getmtime(glossary_file))
     else:
         glossary = {}
 
-    # Add our special markers to the glossary so they are never at risk of translation/modification
-    glossary[START_MARKER] = START_MARKER
-    glossary[END_MARKER] = END_MARKER
-    # Add special syntax used by Galaxy
-    for item in GALAXY_SYNTAX_STRINGS:
-        glossary[item] = item
-
-    for i in range(1, 100):
-        placeholder = "x%03dy" % i
-        glossary[placeholder] = placeholder
-
-    # Not let's do the work
-    total_characters_required = 0
-    total_characters_used = 0
-    for markdown_file in markdown_files:
-        # Construct the output file name/location
-        if output_subdir and output_suffix:
-            raise ValueError(
-                "You must chose between setting a subdirectory for output "
-                "('output_subdir', resulting in 'path/to/example/es/example.md') or "
-                "adding a suffix to the original file name "
-                "('output_suffix', resulting in 'path/to/example/example_es.md')"
-            )
-        if output_subdir:
-            split_path = os.path.split(markdown_file)
-            output_file = os.path.join(split_path[0], target_lang, split_path[1])
-        elif output_suffix:
-            # Split on the extension this time
-            split_path = os.path.splitext(markdown_file)
-            output_file = (
-                split_path[0]
-                + "%s%s" % (output_suffix_char, target_lang)
-                + split_path[1]
-            )
-        else:
-            output_file = None
-        if authentication_key:
-            pre_avail_quota = avail_char_quota_deepl(auth_key=authentication_key)
-        else:
-            pre_avail_quota = -1
-        char_count = translate_markdown_file(
-            markdown_file,
-            output_file=output_file,
-            source_lang=source_lang,
-            target_lang=target_lang,
-            glossary=glossary,
-            auth_key=authentication_key,
-            char_count_only=char_count_only,
-        )
-        total_characters_required += char_count
-        if authentication_key:
-            post_avail_quota = avail_char_quota_deepl(auth_key=authentication_key)
-        else:
-            post_avail_quota = -1
-        if char_count_only:
-            if pre_avail_quota == -1:
-                quota = "Unknown"
-            else:
-                quota = "%d" % pre_avail_quota
-            print(
-                "%s: Translation would use %d characters, available quota is %s"
-                % (markdown_file, char_count, quota)
-            )
-            if 0 < pre_avail_quota < char_count:
-                print(
-                    "You would not have enough quota to carry out this translation!",
-                    file=sys.stderr,
-                )
-        else:
-            actual_quota_usage = pre_avail_quota - post_avail_quota
-            total_characters_used += actual_quota_usage
-            print(
-                "%s: Translation used %d characters, you have %d quota remaining"
-                % (markdown_file, actual_quota_usage, post_avail_quota)
-            )
-            if actual_quota_usage > int(1.1 * char_count):
-                print(
-                    "Expected quota usage (%d) larger than estimated (%d)! "
-                    % (actual_quota_usage, char_count),
-                    file=sys.stderr,
-                )
-    if len(markdown_files) > 1:
-        print(
-            "Total characters required for translation: %d" % total_characters_required
-        )
-        if total_characters_used:
-            print("Total characters used: %d" % total_characters_used)
+    translate_markdown_file_list(
+        markdown_files,
+        source_lang=source_lang,
+        target_lang=target_lang,
+        output_subdir=output_subdir,
+        output_suffix=output_suffix,
+        output_suffix_char=output_suffix_char,
+        char_count_only=char_count_only,
+        glossary=glossary,
+        auth_key=authentication_key,
+        no_cache=no_cache,
+        parallel=parallel,
+        skip_words=skip_words,
+    )
 
 
 if __name__ == "__main__":